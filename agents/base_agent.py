@@ -1,34 +1,80 @@
+import orjson
+import logging
+from string import Template
+from typing import Literal
+from datetime import datetime, timezone
+import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+INSTRUCTIONS = {
+    "detailed": "Generate a detailed and comprehensive final response for the task based on the company information and user answers to questions. Provide in-depth, actionable insights relevant to the task, including specific recommendations, potential challenges, and strategic considerations. Structure the response with clear sections (e.g., Overview, Key Insights, Recommendations, Conclusion) to ensure clarity and depth.",
+    "concise": "Generate a concise response to the follow-up question, ensuring relevance to the task and company context. Keep the response brief, focused, and directly addressing the user's query."
+}
+
+# Byte-stable company info so prompt prefixes match across calls
+def format_company_info(company_info):
+    return orjson.dumps({k: str(v).strip() for k, v in company_info.items() if v}, option=orjson.OPT_SORT_KEYS).decode()
+
+# Static task + company prefix shared by question, final and follow-up prompts
+def build_context(task_name, company_info):
+    return f"Task: {task_name}\nCompany Info: {format_company_info(company_info)}"
+
 class BaseAgent:
-    def __init__(self, model, task_name):
+    PREFIX_TEMPLATE = Template("$context\n\n$instruction\n---\n")
+    # Instruction-only prefixes for when task and company info come from the context cache
+    CACHED_PREFIXES = {level: f"{instruction}\n---\n" for level, instruction in INSTRUCTIONS.items()}
+
+    def __init__(self, model, task_name, company_info, cached_content=None):
         self.model = model
         self.task_name = task_name
+        self.cached_content = cached_content
+        self.cached_model = None
+        self.last_error = None
+        if cached_content is not None:
+            self.cached_model = genai.GenerativeModel.from_cached_content(cached_content)
 
-    def generate_final_response(self, conversation_history, company_info, answers):
-        prompt = f"""
-        Task: {self.task_name}
-        Company Info: {company_info}
-        User Answers: {answers}
-        History: {conversation_history}
+        # Static content first, dynamic tail last, so every call shares the same prefix
+        self.context = build_context(task_name, company_info)
+        self.prefixes = {
+            level: self.PREFIX_TEMPLATE.safe_substitute(context=self.context, instruction=instruction)
+            for level, instruction in INSTRUCTIONS.items()
+        }
 
-        Generate a detailed and comprehensive final response for the task based on the company information and user answers to questions. Provide in-depth, actionable insights relevant to the task, including specific recommendations, potential challenges, and strategic considerations. Structure the response with clear sections (e.g., Overview, Key Insights, Recommendations, Conclusion) to ensure clarity and depth.
-        """
+    def _generate(self, detail_level: Literal["concise", "detailed"], tail):
+        # Task and company info already live in the cached prefix until it expires
+        if self.cached_model is not None and datetime.now(timezone.utc) < self.cached_content.expire_time:
+            model, prefix = self.cached_model, self.CACHED_PREFIXES[detail_level]
+        else:
+            model, prefix = self.model, self.prefixes[detail_level]
+        for chunk in self._start_stream(model, prefix + tail):
+            yield chunk.text
+
+    # The first chunk is fetched eagerly, so rate limits (429) surface here and are retried with backoff
+    @retry(
+        retry=retry_if_exception_type(ResourceExhausted),
+        wait=wait_exponential(multiplier=0.5, max=8),
+        stop=stop_after_attempt(4),
+        reraise=True
+    )
+    def _start_stream(self, model, prompt):
+        return model.generate_content(prompt, stream=True)
+
+    # Both responses stream text chunks as they arrive; last_error is set if generation failed
+    def generate_final_response(self, conversation_history, answers):
+        self.last_error = None
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            yield from self._generate("detailed", f"User Answers: {answers}\nHistory: {conversation_history}")
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            logging.error(f"Final response generation failed: {str(e)}")
+            self.last_error = e
+            yield f"Error generating response: {str(e)}"
 
-    def generate_follow_up_response(self, conversation_history, company_info, user_input):
-        prompt = f"""
-        Task: {self.task_name}
-        Company Info: {company_info}
-        User Follow-Up: {user_input}
-        History: {conversation_history}
-
-        Generate a concise response to the follow-up question, ensuring relevance to the task and company context. Keep the response brief, focused, and directly addressing the user's query.
-        """
+    def generate_follow_up_response(self, conversation_history, user_input):
+        self.last_error = None
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
-        except:
-            return "Unable to process follow-up question."
+            yield from self._generate("concise", f"User Follow-Up: {user_input}\nHistory: {conversation_history}")
+        except Exception as e:
+            logging.error(f"Follow-up response generation failed: {str(e)}")
+            self.last_error = e
+            yield "Unable to process follow-up question."
@@ -1,5 +1,5 @@
 from .base_agent import BaseAgent
 
 class StrategicPlanningAgent(BaseAgent):
-    def __init__(self, model):
-        super().__init__(model, "Strategic Planning")
\ No newline at end of file
+    def __init__(self, model, company_info, cached_content=None):
+        super().__init__(model, "Strategic Planning", company_info, cached_content)
\ No newline at end of file
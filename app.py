@@ -1,54 +1,168 @@
 import streamlit as st
 import google.generativeai as genai
-import json
+import orjson
+import msgspec
 import os
 import logging
+import asyncio
+import re
+import threading
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from agents.base_agent import build_context, format_company_info
 from agents.strategic_planning_agent import StrategicPlanningAgent
 from agents.organizational_assessment_agent import OrganizationalAssessmentAgent
 from agents.operational_efficiency_agent import OperationalEfficiencyAgent
 from agents.stakeholder_engagement_agent import StakeholderEngagementAgent
+from sentence_transformers import SentenceTransformer
+from utils.cache_keys import company_items, final_cache_key, normalize_company_info, task_cache_key
+from utils.llm_cache import LLMCache
+from utils.questions import decode_question_batch, decode_questions
+from utils.semantic_cache import SemanticCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load environment variables from .env
-load_dotenv()
+# Load environment variables, configure Gemini and build the model once per process
+@st.cache_resource
+def get_model():
+    # Load environment variables from .env
+    load_dotenv()
 
-# Try to get Gemini API key: first from Streamlit secrets, then .env
-try:
-    GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY")
-except (AttributeError, KeyError):
-    logging.info("GEMINI_API_KEY not found in Streamlit secrets, falling back to .env")
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    # Try to get Gemini API key: first from Streamlit secrets, then .env
+    try:
+        api_key = st.secrets.get("GEMINI_API_KEY")
+    except (AttributeError, KeyError):
+        logging.info("GEMINI_API_KEY not found in Streamlit secrets, falling back to .env")
+        api_key = os.getenv("GEMINI_API_KEY")
+
+    if not api_key:
+        raise KeyError("GEMINI_API_KEY")
 
-# If key is still not found, show error and stop
-if not GEMINI_API_KEY:
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel('gemini-2.0-flash')
+    logging.info("Gemini API configured successfully")
+    return model
+
+try:
+    model = get_model()
+except KeyError:
+    # If key is still not found, show error and stop
     st.error("GEMINI_API_KEY not found. Please set it in Streamlit secrets or .env.")
     logging.error("GEMINI_API_KEY not found in Streamlit secrets or .env")
     st.stop()
+except Exception as e:
+    st.error(f"Failed to configure Gemini API: {str(e)}")
+    logging.error(f"Gemini API configuration failed: {str(e)}")
+    st.stop()
 
-# Configure Gemini API
-if 'gemini_configured' not in st.session_state:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        st.session_state.model = genai.GenerativeModel('gemini-2.0-flash')
-        st.session_state.gemini_configured = True
-        logging.info("Gemini API configured successfully")
-    except Exception as e:
-        st.error(f"Failed to configure Gemini API: {str(e)}")
-        logging.error(f"Gemini API configuration failed: {str(e)}")
-        st.stop()
-        
-model = st.session_state.model
-# Track API calls
-if 'api_call_count' not in st.session_state:
-    st.session_state.api_call_count = 0
+# Session state defaults; mutable values are given as factories so sessions never share them
+SESSION_DEFAULTS = {
+    "api_call_count": 0,
+    "conversation": list,
+    "history_str": "",
+    "history_summary": "",
+    "summarized_count": 0,
+    "analysis_index": None,
+    "company_info": dict,
+    "selected_task": None,
+    "agent": None,
+    "question_phase": True,
+    "questions_asked": 0,
+    "current_questions": list,
+    "answers": list,
+    "final_response_generated": False,
+    "follow_up_count": 0,
+    "max_follow_ups": 5,
+    "last_company_info": dict,
+    "last_task": None,
+    "ratings": dict,
+    "show_follow_up": False,
+    "analysis_error": None,
+    "question_cache": dict,
+    "context_cache": dict
+}
 
+# Track API calls
 def increment_api_call():
     st.session_state.api_call_count += 1
     logging.info(f"API call count incremented to {st.session_state.api_call_count}")
 
+# History sent to the model is bounded: older messages are folded into a rolling summary
+HISTORY_CHAR_LIMIT = int(os.getenv("HISTORY_CHAR_LIMIT", 4000))
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", 6))
+
+def format_message(message):
+    return f"{message['role']}: {message['content']}"
+
+# Append a chat message and keep the rolling history string sent to the model in sync
+def append_message(message):
+    st.session_state.conversation.append(message)
+    line = format_message(message)
+    st.session_state.history_str = f"{st.session_state.history_str}\n{line}" if st.session_state.history_str else line
+
+def clear_conversation():
+    st.session_state.conversation = []
+    st.session_state.history_str = ""
+    st.session_state.history_summary = ""
+    st.session_state.summarized_count = 0
+    st.session_state.analysis_index = None
+
+# The verbatim tail is the last HISTORY_KEEP_MESSAGES messages, capped at HISTORY_CHAR_LIMIT characters
+# (always at least the latest message). Everything older is folded into the summary once it exceeds half
+# the limit. The latest final analysis is what follow-ups ask about, so it is never summarized and does
+# not count towards either limit; prompt_history keeps sending it verbatim
+def summarize_if_needed():
+    if len(st.session_state.history_str) <= HISTORY_CHAR_LIMIT:
+        return
+    start = st.session_state.summarized_count
+    pending = st.session_state.conversation[start:]
+    analysis_index = st.session_state.analysis_index
+    pinned = analysis_index - start if analysis_index is not None and analysis_index >= start else None
+    keep, tail_size = 0, 0
+    for i in range(len(pending) - 1, max(len(pending) - HISTORY_KEEP_MESSAGES, 0) - 1, -1):
+        if i != pinned:
+            tail_size += len(format_message(pending[i])) + 1
+        if keep and tail_size > HISTORY_CHAR_LIMIT:
+            break
+        keep += 1
+    cut = len(pending) - keep
+    older = "\n".join(format_message(m) for i, m in enumerate(pending[:cut]) if i != pinned)
+    if len(older) <= HISTORY_CHAR_LIMIT // 2:
+        return
+
+    prompt = f"""Summarize this business analysis conversation in under 200 tokens, keeping the facts, answers and recommendations needed to answer follow-up questions.
+Previous summary: {st.session_state.history_summary or "None"}
+Conversation:
+{older}"""
+    try:
+        response = model.generate_content(prompt, generation_config={"max_output_tokens": 256})
+        increment_api_call()
+        summary = response.text.strip()
+    except Exception as e:
+        logging.error(f"History summarization failed, sending full history: {str(e)}")
+        return
+
+    logging.info(f"Summarized {cut} messages into history summary")
+    st.session_state.history_summary = summary
+    st.session_state.summarized_count += cut
+    st.session_state.history_str = "\n".join(format_message(m) for m in pending[cut:])
+
+# Summary of older messages, the latest final analysis and the recent messages verbatim
+def prompt_history():
+    summarize_if_needed()
+    parts = []
+    if st.session_state.history_summary:
+        parts.append(f"Summary of earlier conversation: {st.session_state.history_summary}")
+    analysis_index = st.session_state.analysis_index
+    if analysis_index is not None and analysis_index < st.session_state.summarized_count:
+        parts.append(format_message(st.session_state.conversation[analysis_index]))
+    parts.append(st.session_state.history_str)
+    return "\n".join(parts)
+
+# Leading ```/```json and trailing ``` fences around model JSON output
+JSON_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+
 # Dictionary mapping task names to agent classes
 AGENT_CLASSES = {
     "Strategic Planning": StrategicPlanningAgent,
@@ -57,22 +171,139 @@ AGENT_CLASSES = {
     "Stakeholder Engagement Strategy": StakeholderEngagementAgent
 }
 
-# Normalize company info for consistent cache key
-def normalize_company_info(company_info):
-    return {
-        "name": company_info.get("name", ""),
-        "industry": company_info.get("industry", ""),
-        "size": company_info.get("size", ""),
-        "description": company_info.get("description", "")
-    }
-
-# Generate up to 5 questions (MCQ, Radio, Input) with fallback
-def generate_task_questions(task, company_info):
+# On-disk question cache shared by all sessions
+@st.cache_resource
+def get_llm_cache():
+    return LLMCache(os.getenv("LLM_CACHE_PATH", "llm_cache.db"), int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)))
+
+@st.cache_resource
+def get_encoder():
+    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+
+# Rebuilt from the embeddings persisted next to live cache rows, so near-duplicate matching survives restarts
+@st.cache_resource
+def get_semantic_cache():
+    cache = SemanticCache(get_encoder(), float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)))
+    cache.load(get_llm_cache().embeddings())
+    return cache
+
+# The task and company name must match exactly; a different name never reuses another company's questions
+def semantic_partition(task, company_info):
+    return (task, company_info.get("name", "").strip().lower())
+
+# Only the descriptive fields are fuzzy-matched, description last so encoder truncation only cuts its tail
+def semantic_company_text(company_info):
+    return "\n".join(company_info.get(field, "") for field in ("industry", "size", "description"))
+
+# Exact lookup, then nearest-neighbour lookup for near-duplicate prompts. The text is embedded only on an
+# exact miss and only if no vector is passed in; the vector is returned for write-through and reuse
+def lookup_cached(partition, key, text, vector=None):
+    value = get_llm_cache().get(key)
+    if value is not None:
+        logging.info(f"Persistent cache hit for key: {key.hex()}")
+        return value, vector
+    # The semantic layer is only an optimization: if the encoder or index fails, fall back to exact matches
+    try:
+        if vector is None:
+            vector = get_semantic_cache().embed(text)
+        match_key = get_semantic_cache().lookup(partition, vector)
+        if match_key is not None:
+            value = get_llm_cache().get(match_key)
+            if value is not None:
+                logging.info(f"Semantic cache hit for key: {key.hex()} (matched {match_key.hex()})")
+            else:
+                get_semantic_cache().remove(match_key)
+    except Exception as e:
+        logging.warning(f"Semantic cache lookup failed, using exact matches only: {str(e)}")
+    return value, vector
+
+# A None vector (semantic lookup failed) stores the value for exact matches only
+def store_cached(partition, key, vector, value):
+    expires_at = get_llm_cache().set(key, value)
+    if vector is None:
+        return
+    try:
+        get_semantic_cache().add(partition, key, vector, expires_at)
+        get_llm_cache().set_embedding(key, partition, vector.tobytes())
+    except Exception as e:
+        logging.warning(f"Semantic cache update failed: {str(e)}")
+
+# Persistent event loop for concurrent Gemini calls; the async client is bound to the loop it was first used on
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+# Gemini rejects context caches below a minimum size; estimate tokens locally so small prefixes cost no round trip
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 4096))
+CHARS_PER_TOKEN = 4
+
+# Create an explicit Gemini context cache holding the task + company info prefix; None if too small or unavailable
+def create_context_cache(task, company_info):
+    if len(build_context(task, company_info)) // CHARS_PER_TOKEN < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    try:
+        cached = genai.caching.CachedContent.create(
+            model='gemini-2.0-flash',
+            system_instruction=f"You are a business analysis assistant for the task: {task}.",
+            contents=[build_context(task, company_info)],
+            ttl=timedelta(minutes=10)
+        )
+        logging.info(f"Created context cache {cached.name} for task: {task}")
+        return cached
+    except Exception as e:
+        logging.warning(f"Context cache unavailable, using full prompts: {str(e)}")
+        return None
+
+def delete_context_cache(cached):
+    try:
+        cached.delete()
+    except Exception as e:
+        logging.warning(f"Failed to delete context cache: {str(e)}")
+
+# Remember a task's context cache, deleting any handle it replaces so billed storage never leaks
+def store_context_cache(cache_key, cached):
+    previous = st.session_state.context_cache.get(cache_key)
+    if previous is cached:
+        return
+    if previous is not None:
+        delete_context_cache(previous)
+    if cached is not None:
+        increment_api_call()
+    st.session_state.context_cache[cache_key] = cached
+
+# The session's context cache for the task + company info, or None if missing or expired.
+# Caches are only created for the selected task alongside its question generation, never on a cache hit
+def get_context_cache(task, company_info):
+    cached = st.session_state.context_cache.get(task_cache_key(task, company_items(company_info)))
+    if cached is not None and datetime.now(timezone.utc) < cached.expire_time:
+        return cached
+    return None
+
+async def warm_context_cache(task, company_info):
+    return await asyncio.to_thread(create_context_cache, task, company_info)
+
+# Drop all context caches, e.g. when the company info changes
+def clear_context_cache():
+    for cached in st.session_state.context_cache.values():
+        if cached is not None:
+            delete_context_cache(cached)
+    st.session_state.context_cache = {}
+
+# Strip markdown formatting around a JSON response
+def clean_json_response(response):
+    response_text = JSON_FENCE_RE.sub("", getattr(response, 'text', '')).strip()
+    logging.info(f"Cleaned response: {response_text}")
+    return response_text
+
+# Generate up to 5 questions (MCQ, Radio, Input); None if generation fails
+async def generate_task_questions(task, company_info):
     logging.info(f"Generating questions for task: {task} with company info: {company_info}")
-    company_info_str = ", ".join(f"{k}: {v}" for k, v in company_info.items() if v)
-    prompt = f"""
-    Task: {task}
-    Company Info: {company_info_str}
+    prompt = f"""{build_context(task, company_info)}
 
     Generate up to 5 short questions (max 15 words each) about the company for the task, including:
     - At least 1 MCQ with 4 options.
@@ -92,43 +323,108 @@ def generate_task_questions(task, company_info):
     """
 
     try:
-        response = model.generate_content(prompt)
-        increment_api_call()
-        response_text = getattr(response, 'text', '').strip()
-
-        # Strip markdown formatting
-        if response_text.startswith("```json"):
-            response_text = response_text.lstrip("```json").rstrip("```").strip()
-        elif response_text.startswith("```"):
-            response_text = response_text.strip("```").strip()
-
-        logging.info(f"Cleaned response: {response_text}")
-
+        response = await model.generate_content_async(prompt)
         try:
-            questions = json.loads(response_text)
-            valid_questions = []
-            for q in questions:
-                if "type" in q and "question" in q:
-                    if q["type"] in ["MCQ", "Radio"] and "options" in q:
-                        valid_questions.append(q)
-                    elif q["type"] == "Input":
-                        q.setdefault("options", [])
-                        valid_questions.append(q)
-
-            if valid_questions:
-                logging.info(f"Generated {len(valid_questions)} valid questions")
-                return valid_questions[:5]
+            questions = decode_questions(clean_json_response(response))
+            if questions:
+                logging.info(f"Generated {len(questions)} valid questions")
+                return questions
             else:
                 logging.warning("No valid questions found in the response")
-                return fallback_questions()
+                return None
+
+        except msgspec.ValidationError as e:
+            logging.warning(f"Invalid questions in the response: {str(e)}")
+            return None
 
-        except json.JSONDecodeError as e:
+        except msgspec.DecodeError as e:
             logging.error(f"JSON parsing failed: {str(e)}")
-            return fallback_questions()
+            return None
 
     except Exception as e:
         logging.error(f"Question generation failed: {str(e)}")
-        return fallback_questions()
+        return None
+
+# Generate questions for several tasks in a single request, keyed by task name; None if the request fails
+def generate_all_task_questions(tasks, company_info):
+    logging.info(f"Generating questions for tasks: {tasks} with company info: {company_info}")
+    task_list = "\n".join(f"    - {task}" for task in tasks)
+    prompt = f"""Company Info: {format_company_info(company_info)}
+
+    For each of these tasks:
+{task_list}
+
+    Generate up to 5 short questions (max 15 words each) about the company for the task, including:
+    - At least 1 MCQ with 4 options.
+    - At least 1 Radio question with 3 options.
+    - At least 1 Input-type question (short text input).
+    - Focus on company details relevant to the task.
+    - Ensure questions elicit detailed insights for a comprehensive analysis of that task.
+
+    Output as a JSON object mapping each task name exactly as listed to its JSON array of questions:
+    {{
+        "Task name": [
+            {{
+                "type": "MCQ" or "Radio" or "Input",
+                "question": "Question text",
+                "options": ["Option1", "Option2", ...] (for MCQ and Radio only)
+            }}
+        ]
+    }}
+    """
+
+    # Counted once the request goes out, even if it then fails or returns bad JSON
+    increment_api_call()
+    try:
+        response = model.generate_content(prompt)
+        batch = decode_question_batch(clean_json_response(response))
+    except Exception as e:
+        logging.error(f"Batch question generation failed: {str(e)}")
+        return None
+
+    questions = {}
+    for task in tasks:
+        if task not in batch:
+            continue
+        try:
+            questions[task] = decode_questions(batch[task])
+        except msgspec.DecodeError as e:
+            logging.warning(f"Invalid questions for task {task}: {str(e)}")
+    return questions
+
+# Pre-warm the question caches for every task with at most one Gemini call
+def prefetch_all_task_questions(company_info):
+    missing = {}
+    # Every task embeds the same company text, so it is encoded at most once
+    text, vector = semantic_company_text(company_info), None
+    for task in AGENT_CLASSES:
+        cache_key = task_cache_key(task, company_items(company_info))
+        questions, vector = lookup_cached(semantic_partition(task, company_info), cache_key, text, vector)
+        if questions is not None:
+            st.session_state.question_cache[cache_key] = questions
+        else:
+            missing[task] = (cache_key, vector)
+    if not missing:
+        return
+
+    generated = generate_all_task_questions(list(missing), company_info)
+    if generated is None:
+        return
+
+    for task, questions in generated.items():
+        if questions:
+            cache_key, vector = missing[task]
+            st.session_state.question_cache[cache_key] = questions
+            store_cached(semantic_partition(task, company_info), cache_key, vector, questions)
+
+# Generate questions while the context cache is created, hiding one round trip; a live cache is reused
+async def prefetch_task(task, company_info, cached_content):
+    if cached_content is not None:
+        return await generate_task_questions(task, company_info), cached_content
+    return await asyncio.gather(
+        generate_task_questions(task, company_info),
+        warm_context_cache(task, company_info)
+    )
 
 # Fallback question list
 def fallback_questions():
@@ -139,6 +435,101 @@ def fallback_questions():
         {"type": "Input", "question": "Describe your key product.", "options": []}
     ]
 
+# Total progress steps only change with the question list or the follow-up limit, so compute them there
+def update_total_steps():
+    st.session_state.total_steps = max(len(st.session_state.current_questions), 7) + 1 + st.session_state.max_follow_ups
+
+def set_current_questions(questions):
+    st.session_state.current_questions = questions
+    update_total_steps()
+
+# Progress bar; current progress can never exceed total_steps
+def render_progress():
+    current_progress = st.session_state.questions_asked + (1 if st.session_state.final_response_generated else 0) + st.session_state.follow_up_count
+    st.progress(current_progress / st.session_state.total_steps, text=f"Step {current_progress} of {st.session_state.total_steps}")
+
+# Chat display
+def render_conversation():
+    for idx, message in enumerate(st.session_state.conversation):
+        with st.chat_message(message["role"], avatar="🤖" if message["role"] == "assistant" else "👤"):
+            st.markdown(message["content"])
+            if message["role"] == "assistant" and message.get("is_final_or_follow_up", False):
+                if idx not in st.session_state.ratings:
+                    with st.form(key=f"rating_form_{idx}"):
+                        rating = st.slider("Rate this response", 1, 5, 3, key=f"rating_{idx}")
+                        if st.form_submit_button("Submit Rating"):
+                            st.session_state.ratings[idx] = rating
+                            if idx == len(st.session_state.conversation) - 1 and not st.session_state.show_follow_up:
+                                st.session_state.show_follow_up = True
+                            st.rerun()
+                else:
+                    st.write(f"Rating: {st.session_state.ratings[idx]} / 5")
+
+# Rendered in the main area rather than the sidebar, so the question fragment keeps it current
+def render_download():
+    if st.session_state.conversation:
+        chat_json = orjson.dumps(st.session_state.conversation, option=orjson.OPT_INDENT_2)
+        st.download_button("Download Chat History", chat_json, "chat_history.json", "application/json")
+
+# Question phase as a fragment: submitting an answer reruns only this block, so it also
+# renders the progress bar and the answered questions, which would otherwise go stale
+@st.fragment
+def question_form():
+    render_progress()
+    render_conversation()
+    question = st.session_state.current_questions[st.session_state.questions_asked]
+    with st.chat_message("assistant", avatar="🤖"):
+        with st.form(key=f"question_form_{st.session_state.questions_asked}"):
+            st.markdown(question["question"])
+            if question["type"] in ["MCQ", "Radio"]:
+                answer = st.selectbox("Choose an option", question["options"], key=f"select_{st.session_state.questions_asked}")
+            else:  # Input
+                answer = st.text_input("Your answer", key=f"input_{st.session_state.questions_asked}")
+            if st.form_submit_button("Submit"):
+                if answer or question["type"] in ["MCQ", "Radio"]:
+                    append_message({"role": "assistant", "content": question["question"]})
+                    append_message({"role": "user", "content": answer})
+                    st.session_state.answers.append({
+                        "question": question["question"],
+                        "answer": answer,
+                        "type": question["type"]
+                    })
+                    st.session_state.questions_asked += 1
+                    if st.session_state.questions_asked >= len(st.session_state.current_questions):
+                        st.session_state.question_phase = False
+                        logging.info("All questions answered, proceeding to analysis")
+                        # Leaving the question phase needs the whole app
+                        st.rerun()
+                    st.rerun(scope="fragment")
+                else:
+                    st.error("Please provide an answer.")
+    render_download()
+
+# Follow-up input as a fragment so submitting it does not rerun the whole script first
+@st.fragment
+def follow_up_input():
+    user_input = st.chat_input("Ask a follow-up question or provide feedback...")
+    if user_input:
+        try:
+            append_message({"role": "user", "content": user_input})
+            st.session_state.follow_up_count += 1
+            with st.chat_message("user", avatar="👤"):
+                st.markdown(user_input)
+            with st.chat_message("assistant", avatar="🤖"), st.spinner("Processing follow-up..."):
+                history = prompt_history()
+                response = st.write_stream(st.session_state.agent.generate_follow_up_response(history, user_input)).strip()
+                increment_api_call()
+                logging.info(f"Follow-up Response:\n{response}")
+                append_message({
+                    "role": "assistant",
+                    "content": response,
+                    "is_final_or_follow_up": True
+                })
+        except Exception as e:
+            logging.error(f"Failed to generate follow-up response: {str(e)}")
+            st.error("Error processing follow-up. Please try again.")
+        st.rerun()
+
 # Streamlit app
 def main():
     st.set_page_config(page_title="AI Business Analysis", layout="wide")
@@ -146,40 +537,12 @@ def main():
     st.markdown("Analyze your company with tasks like Strategic Planning, Organizational Assessment, Operational Efficiency, and Stakeholder Engagement.")
 
     # Initialize session state
-    if 'conversation' not in st.session_state:
-        st.session_state.conversation = []
-    if 'company_info' not in st.session_state:
-        st.session_state.company_info = {}
-    if 'selected_task' not in st.session_state:
-        st.session_state.selected_task = None
-    if 'agent' not in st.session_state:
-        st.session_state.agent = None
-    if 'question_phase' not in st.session_state:
-        st.session_state.question_phase = True
-    if 'questions_asked' not in st.session_state:
-        st.session_state.questions_asked = 0
-    if 'current_questions' not in st.session_state:
-        st.session_state.current_questions = []
-    if 'answers' not in st.session_state:
-        st.session_state.answers = []
-    if 'final_response_generated' not in st.session_state:
-        st.session_state.final_response_generated = False
-    if 'follow_up_count' not in st.session_state:
-        st.session_state.follow_up_count = 0
-    if 'max_follow_ups' not in st.session_state:
-        st.session_state.max_follow_ups = 5
-    if 'last_company_info' not in st.session_state:
-        st.session_state.last_company_info = {}
-    if 'last_task' not in st.session_state:
-        st.session_state.last_task = None
-    if 'ratings' not in st.session_state:
-        st.session_state.ratings = {}
-    if 'show_follow_up' not in st.session_state:
-        st.session_state.show_follow_up = False
-    if 'analysis_error' not in st.session_state:
-        st.session_state.analysis_error = None
-    if 'question_cache' not in st.session_state:
-        st.session_state.question_cache = {}
+    for key, default in SESSION_DEFAULTS.items():
+        if key not in st.session_state:
+            st.session_state[key] = default() if callable(default) else default
+    # Derived from current_questions and max_follow_ups, so it is computed here rather than listed in SESSION_DEFAULTS
+    if 'total_steps' not in st.session_state:
+        update_total_steps()
 
     # Sidebar for company info and controls
     with st.sidebar:
@@ -191,18 +554,19 @@ def main():
             company_description = st.text_area("Company Description", placeholder="Describe your company...")
             if st.form_submit_button("Submit"):
                 if company_name and industry:
-                    new_company_info = normalize_company_info({
+                    # Copy the memoized result so session edits can never leak into the shared cache entry
+                    new_company_info = dict(normalize_company_info(company_items({
                         "name": company_name,
                         "industry": industry,
                         "size": size,
                         "description": company_description
-                    })
+                    })))
                     if new_company_info != st.session_state.company_info:
                         logging.info(f"Company info changed: {new_company_info}")
                         st.session_state.company_info = new_company_info
                         st.session_state.last_company_info = new_company_info.copy()
                         st.session_state.selected_task = None
-                        st.session_state.current_questions = []
+                        set_current_questions([])
                         st.session_state.answers = []
                         st.session_state.question_phase = True
                         st.session_state.questions_asked = 0
@@ -211,7 +575,10 @@ def main():
                         st.session_state.ratings = {}
                         st.session_state.show_follow_up = False
                         st.session_state.question_cache = {}
+                        clear_context_cache()
                         st.session_state.analysis_error = None
+                        with st.spinner("Preparing questions..."):
+                            prefetch_all_task_questions(new_company_info)
                         st.success("Company information saved!")
                         st.rerun()
                 else:
@@ -222,9 +589,9 @@ def main():
         if selected_task and selected_task != st.session_state.selected_task:
             logging.info(f"Task changed to: {selected_task}")
             st.session_state.selected_task = selected_task
-            st.session_state.conversation = []
-            st.session_state.agent = AGENT_CLASSES[selected_task](model)
-            st.session_state.current_questions = []
+            clear_conversation()
+            st.session_state.agent = None
+            set_current_questions([])
             st.session_state.answers = []
             st.session_state.question_phase = True
             st.session_state.questions_asked = 0
@@ -242,24 +609,38 @@ def main():
             and st.session_state.company_info
             and not st.session_state.current_questions
         ):
-            cache_key = f"{selected_task}_{json.dumps(normalize_company_info(st.session_state.company_info), sort_keys=True)}"
+            cache_key = task_cache_key(selected_task, company_items(st.session_state.company_info))
             if cache_key in st.session_state.question_cache:
-                logging.info(f"Cache hit for key: {cache_key}")
-                st.session_state.current_questions = st.session_state.question_cache[cache_key]
+                logging.info(f"Cache hit for key: {cache_key.hex()}")
+                set_current_questions(st.session_state.question_cache[cache_key])
+                cached_content = get_context_cache(selected_task, st.session_state.company_info)
             else:
-                logging.info(f"Cache miss for key: {cache_key}, generating questions")
-                questions = generate_task_questions(selected_task, st.session_state.company_info)
+                questions, vector = lookup_cached(semantic_partition(selected_task, st.session_state.company_info), cache_key, semantic_company_text(st.session_state.company_info))
+                if questions is not None:
+                    cached_content = get_context_cache(selected_task, st.session_state.company_info)
+                else:
+                    logging.info(f"Cache miss for key: {cache_key.hex()}, generating questions")
+                    cached_content = get_context_cache(selected_task, st.session_state.company_info)
+                    questions, cached_content = run_async(prefetch_task(selected_task, st.session_state.company_info, cached_content))
+                    increment_api_call()
+                    store_context_cache(cache_key, cached_content)
+                    # Only persist real model output, never the fallback list
+                    if questions:
+                        store_cached(semantic_partition(selected_task, st.session_state.company_info), cache_key, vector, questions)
+                    else:
+                        questions = fallback_questions()
                 st.session_state.question_cache[cache_key] = questions
-                st.session_state.current_questions = questions
+                set_current_questions(questions)
+            st.session_state.agent = AGENT_CLASSES[selected_task](model, st.session_state.company_info, cached_content)
 
         if st.button("Clear History"):
             logging.info("Clearing history")
-            st.session_state.conversation = []
+            clear_conversation()
             st.session_state.agent = None
             st.session_state.selected_task = None
             st.session_state.question_phase = True
             st.session_state.questions_asked = 0
-            st.session_state.current_questions = []
+            set_current_questions([])
             st.session_state.answers = []
             st.session_state.final_response_generated = False
             st.session_state.follow_up_count = 0
@@ -270,88 +651,53 @@ def main():
             st.session_state.question_cache = {}
             st.session_state.analysis_error = None
             st.rerun()
-        if st.session_state.conversation:
-            chat_json = json.dumps(st.session_state.conversation, indent=2)
-            st.download_button("Download Chat History", chat_json, "chat_history.json", "application/json")
 
     # Main chat interface
     if st.session_state.company_info and st.session_state.selected_task and st.session_state.current_questions:
         st.subheader(f"Task: {st.session_state.selected_task}")
-        # Progress bar
-        total_steps = max(len(st.session_state.current_questions), 7) + 1 + st.session_state.max_follow_ups
-        current_progress = st.session_state.questions_asked + (1 if st.session_state.final_response_generated else 0) + st.session_state.follow_up_count
-        progress = min(current_progress / total_steps, 1.0)
-        st.progress(progress, text=f"Step {current_progress} of {total_steps}")
-
-        # Chat display
-        for idx, message in enumerate(st.session_state.conversation):
-            with st.chat_message(message["role"], avatar="🤖" if message["role"] == "assistant" else "👤"):
-                st.markdown(message["content"])
-                if message["role"] == "assistant" and message.get("is_final_or_follow_up", False):
-                    if idx not in st.session_state.ratings:
-                        with st.form(key=f"rating_form_{idx}"):
-                            rating = st.slider("Rate this response", 1, 5, 3, key=f"rating_{idx}")
-                            if st.form_submit_button("Submit Rating"):
-                                st.session_state.ratings[idx] = rating
-                                if idx == len(st.session_state.conversation) - 1 and not st.session_state.show_follow_up:
-                                    st.session_state.show_follow_up = True
-                                st.rerun()
-                    else:
-                        st.write(f"Rating: {st.session_state.ratings[idx]} / 5")
 
         # Question phase
         if st.session_state.question_phase and st.session_state.questions_asked < len(st.session_state.current_questions):
-            question = st.session_state.current_questions[st.session_state.questions_asked]
-            with st.chat_message("assistant", avatar="🤖"):
-                with st.form(key=f"question_form_{st.session_state.questions_asked}"):
-                    st.markdown(question["question"])
-                    if question["type"] in ["MCQ", "Radio"]:
-                        answer = st.selectbox("Choose an option", question["options"], key=f"select_{st.session_state.questions_asked}")
-                    else:  # Input
-                        answer = st.text_input("Your answer", key=f"input_{st.session_state.questions_asked}")
-                    if st.form_submit_button("Submit"):
-                        if answer or question["type"] in ["MCQ", "Radio"]:
-                            st.session_state.conversation.append({"role": "assistant", "content": question["question"]})
-                            st.session_state.conversation.append({"role": "user", "content": answer})
-                            st.session_state.answers.append({
-                                "question": question["question"],
-                                "answer": answer,
-                                "type": question["type"]
-                            })
-                            st.session_state.questions_asked += 1
-                            if st.session_state.questions_asked >= len(st.session_state.current_questions):
-                                st.session_state.question_phase = False
-                                logging.info("All questions answered, proceeding to analysis")
-                            st.rerun()
-                        else:
-                            st.error("Please provide an answer.")
+            question_form()
+        else:
+            render_progress()
+            render_conversation()
+            render_download()
 
         # Generate final response
-        elif not st.session_state.question_phase and not st.session_state.final_response_generated:
+        if not st.session_state.question_phase and not st.session_state.final_response_generated:
             with st.spinner("Generating detailed analysis..."):
                 try:
-                    company_info_str = ", ".join(f"{k}: {v}" for k, v in st.session_state.company_info.items() if v)
-                    answers_str = json.dumps(st.session_state.answers, indent=2)
-                    history = "\n".join(f"{m['role']}: {m['content']}" for m in st.session_state.conversation)
+                    answers_str = orjson.dumps(st.session_state.answers, option=orjson.OPT_INDENT_2).decode()
+                    history = prompt_history()
                     
-                    response = st.session_state.agent.generate_final_response(history, company_info_str, answers_str)
-                    increment_api_call()
+                    # Exact match only: answers and company name change the analysis even when their embeddings barely move
+                    final_key = final_cache_key(st.session_state.selected_task, st.session_state.company_info, st.session_state.answers)
+                    response = get_llm_cache().get(final_key)
+
+                    # Display analysis in a new section, streaming it if not cached
+                    with st.container():
+                        st.header("Analysis Results")
+                        st.markdown(f"### {st.session_state.selected_task} Analysis")
+                        if response is None:
+                            agent = st.session_state.agent
+                            response = st.write_stream(agent.generate_final_response(history, answers_str)).strip()
+                            increment_api_call()
+                            if agent.last_error is None:
+                                get_llm_cache().set(final_key, response)
+                        else:
+                            st.markdown(response)
                     logging.info(f"Final Analysis Response:\n{response}")
 
-                    # Store and display response
-                    st.session_state.conversation.append({
+                    # Store response
+                    st.session_state.analysis_index = len(st.session_state.conversation)
+                    append_message({
                         "role": "assistant",
                         "content": response,
                         "is_final_or_follow_up": True
                     })
                     st.session_state.final_response_generated = True
 
-                    # Display analysis in a new section
-                    with st.container():
-                        st.header("Analysis Results")
-                        st.markdown(f"### {st.session_state.selected_task} Analysis")
-                        st.markdown(response)
-
                 except Exception as e:
                     error_msg = f"Failed to generate analysis: {str(e)}"
                     logging.error(error_msg)
@@ -366,26 +712,7 @@ def main():
 
         # Follow-up phase
         elif st.session_state.final_response_generated and st.session_state.follow_up_count < st.session_state.max_follow_ups and st.session_state.show_follow_up:
-            user_input = st.chat_input("Ask a follow-up question or provide feedback...")
-            if user_input:
-                try:
-                    st.session_state.conversation.append({"role": "user", "content": user_input})
-                    st.session_state.follow_up_count += 1
-                    with st.spinner("Processing follow-up..."):
-                        company_info_str = ", ".join(f"{k}: {v}" for k, v in st.session_state.company_info.items() if v)
-                        history = "\n".join(f"{m['role']}: {m['content']}" for m in st.session_state.conversation)
-                        response = st.session_state.agent.generate_follow_up_response(history, company_info_str, user_input)
-                        increment_api_call()
-                        logging.info(f"Follow-up Response:\n{response}")
-                        st.session_state.conversation.append({
-                            "role": "assistant",
-                            "content": response,
-                            "is_final_or_follow_up": True
-                        })
-                except Exception as e:
-                    logging.error(f"Failed to generate follow-up response: {str(e)}")
-                    st.error("Error processing follow-up. Please try again.")
-                st.rerun()
+            follow_up_input()
 
 if __name__ == "__main__":
     main()
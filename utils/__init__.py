@@ -0,0 +1,17 @@
+from .cache_keys import company_items, digest_key, final_cache_key, normalize_company_info, task_cache_key
+from .llm_cache import LLMCache
+from .questions import Question, decode_question_batch, decode_questions
+from .semantic_cache import SemanticCache
+
+__all__ = [
+    "company_items",
+    "digest_key",
+    "final_cache_key",
+    "normalize_company_info",
+    "task_cache_key",
+    "LLMCache",
+    "Question",
+    "decode_question_batch",
+    "decode_questions",
+    "SemanticCache"
+]
\ No newline at end of file
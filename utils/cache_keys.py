@@ -0,0 +1,32 @@
+import hashlib
+import orjson
+from functools import lru_cache
+
+# Kept outside app.py: Streamlit re-executes the script on every rerun, which would reset these memo caches
+
+def company_items(company_info):
+    return tuple(sorted(company_info.items()))
+
+# Normalize company info for consistent cache key; memoized on sorted (key, value) pairs, so never mutate the result
+@lru_cache(maxsize=128)
+def normalize_company_info(items):
+    company_info = dict(items)
+    return {
+        "name": company_info.get("name", ""),
+        "industry": company_info.get("industry", ""),
+        "size": company_info.get("size", ""),
+        "description": company_info.get("description", "")
+    }
+
+# Fixed-size 16-byte blake2b digest of the sorted JSON payload keeps dict lookups and SQLite primary keys small
+def digest_key(payload):
+    return hashlib.blake2b(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+# Stable cache key for a task + company info pair
+@lru_cache(maxsize=128)
+def task_cache_key(task, items):
+    return digest_key({"task": task, "company": normalize_company_info(items), "v": 1})
+
+# Cache key for a final analysis, which also depends on the user's answers
+def final_cache_key(task, company_info, answers):
+    return digest_key({"task": task, "company": normalize_company_info(company_items(company_info)), "answers": answers, "v": 1})
@@ -0,0 +1,56 @@
+import orjson
+import sqlite3
+import threading
+import time
+
+# Process-wide cache of LLM outputs shared across sessions and restarts
+class LLMCache:
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, value BLOB, expires_at INTEGER)")
+            # Prompt embeddings for the semantic index, which is otherwise lost on restart
+            self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, partition BLOB, vector BLOB)")
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= time.time():
+                with self.conn:
+                    self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self.conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                return None
+        return orjson.loads(value)
+
+    # Returns the row's expiry timestamp
+    def set(self, key, value, ttl=None):
+        expires_at = int(time.time()) + (ttl if ttl is not None else self.ttl)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, orjson.dumps(value), expires_at)
+            )
+        return expires_at
+
+    def set_embedding(self, key, partition, vector):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, partition, vector) VALUES (?, ?, ?)",
+                (key, orjson.dumps(partition), vector)
+            )
+
+    # Live (key, partition, vector bytes, expires_at) rows; expired rows and orphaned embeddings are purged first
+    def embeddings(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            self.conn.execute("DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM cache)")
+            rows = self.conn.execute(
+                "SELECT embeddings.key, embeddings.partition, embeddings.vector, cache.expires_at "
+                "FROM embeddings JOIN cache ON cache.key = embeddings.key"
+            ).fetchall()
+        return [(key, tuple(orjson.loads(partition)), vector, expires_at) for key, partition, vector, expires_at in rows]
@@ -0,0 +1,23 @@
+from typing import Literal
+import msgspec
+
+class Question(msgspec.Struct):
+    type: Literal["MCQ", "Radio", "Input"]
+    question: str
+    options: list[str] = msgspec.field(default_factory=list)
+
+    def __post_init__(self):
+        # Surfaces as msgspec.ValidationError from the decoder
+        if self.type != "Input" and not self.options:
+            raise ValueError("MCQ and Radio questions require options")
+
+questions_decoder = msgspec.json.Decoder(list[Question])
+batch_decoder = msgspec.json.Decoder(dict[str, msgspec.Raw])
+
+# Parse and validate a JSON array of questions in one pass; returns up to 5 as plain dicts
+def decode_questions(data):
+    return msgspec.to_builtins(questions_decoder.decode(data)[:5])
+
+# Split a {"task name": [questions]} object so each task's list is validated on its own
+def decode_question_batch(data):
+    return batch_decoder.decode(data)
@@ -0,0 +1,75 @@
+import threading
+import time
+import faiss
+import numpy as np
+
+# Nearest-neighbour index over prompt embeddings, mapping similar prompts to an existing cache key
+class SemanticCache:
+    def __init__(self, encoder, threshold):
+        self.encoder = encoder
+        self.threshold = threshold
+        self.dimension = encoder.get_sentence_embedding_dimension()
+        # One index per partition, so only prompts whose exact-match fields agree are ever compared
+        self.partitions = {}
+        # cache key -> (partition, vector id, expires_at); entries mirror the persistent cache's TTL
+        self.entries = {}
+        self.next_id = 0
+        # Earliest expiry among the entries, so adds only scan for stale entries when one can exist
+        self.next_expiry = float("inf")
+        self.lock = threading.Lock()
+
+    def embed(self, text):
+        return self.encoder.encode([text], normalize_embeddings=True).astype("float32")
+
+    # Returns the cache key of the closest live entry above the threshold, or None
+    def lookup(self, partition, vector):
+        with self.lock:
+            if partition not in self.partitions:
+                return None
+            index, keys = self.partitions[partition]
+            scores, ids = index.search(vector, 1)
+            if scores[0][0] >= self.threshold:
+                key = keys[ids[0][0]]
+                if self.entries[key][2] > time.time():
+                    return key
+                self._remove(key)
+        return None
+
+    # Adding an existing key replaces its vector; expired entries are dropped as soon as one exists
+    def add(self, partition, key, vector, expires_at):
+        with self.lock:
+            now = time.time()
+            if now >= self.next_expiry:
+                for stale in [k for k, entry in self.entries.items() if entry[2] <= now]:
+                    self._remove(stale)
+                self.next_expiry = min((entry[2] for entry in self.entries.values()), default=float("inf"))
+            if key in self.entries:
+                self._remove(key)
+            if partition not in self.partitions:
+                # Inner product on L2-normalized vectors is cosine similarity
+                self.partitions[partition] = (faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension)), {})
+            index, keys = self.partitions[partition]
+            index.add_with_ids(vector, np.array([self.next_id], dtype="int64"))
+            keys[self.next_id] = key
+            self.entries[key] = (partition, self.next_id, expires_at)
+            self.next_id += 1
+            self.next_expiry = min(self.next_expiry, expires_at)
+
+    # Rebuild the index from (key, partition, vector bytes, expires_at) rows persisted by LLMCache
+    def load(self, rows):
+        for key, partition, vector, expires_at in rows:
+            self.add(partition, key, np.frombuffer(vector, dtype="float32").reshape(1, -1), expires_at)
+
+    # Forget a key, e.g. once its persistent cache row is gone
+    def remove(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        partition, vector_id, _ = self.entries.pop(key)
+        index, keys = self.partitions[partition]
+        index.remove_ids(np.array([vector_id], dtype="int64"))
+        del keys[vector_id]
+        if not keys:
+            del self.partitions[partition]